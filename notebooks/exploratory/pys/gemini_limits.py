@@ -0,0 +1,21 @@
+import os
+import threading
+from google.api_core.exceptions import DeadlineExceeded, InternalServerError, ResourceExhausted, ServiceUnavailable
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+
+# Cap on concurrent Gemini/Vertex requests from this process
+GEMINI_MAX_INFLIGHT = int(os.environ.get('GEMINI_MAX_INFLIGHT', '8'))
+GEMINI_INFLIGHT = threading.BoundedSemaphore(GEMINI_MAX_INFLIGHT)
+
+# Back off on quota and transient server errors: from 1s, doubling with jitter, capped at 15s
+gemini_retry = retry(
+    retry=retry_if_exception_type((
+        ResourceExhausted,
+        ServiceUnavailable,
+        DeadlineExceeded,
+        InternalServerError
+    )),
+    stop=stop_after_attempt(5),
+    wait=wait_exponential_jitter(initial=1, max=15),
+    reraise=True
+)
@@ -0,0 +1,27 @@
+from kfp.v2 import compiler
+import hashlib
+import os
+import tempfile
+
+# Compile the pipeline, reusing the spec from an earlier run of the same source
+def compile_pipeline(pipeline_func, source_path: str, package_dir: str = tempfile.gettempdir()) -> str:
+    """
+    Compile the pipeline once per source revision and return the path of the compiled spec
+    - source_path is the module defining the pipeline; hashing the whole file means
+      component edits also invalidate the cache
+    """
+    with open(source_path, 'rb') as f:
+        source_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+    package_stem = os.path.join(package_dir, f"{pipeline_func.name}_{source_hash}")
+    package_path = f"{package_stem}.json"
+    
+    if not os.path.exists(package_path):
+        # Compile to a temporary name first so a partial spec is never picked up
+        tmp_path = f"{package_stem}.{os.getpid()}.tmp.json"
+        compiler.Compiler().compile(
+            pipeline_func=pipeline_func,
+            package_path=tmp_path
+        )
+        os.replace(tmp_path, package_path)
+    
+    return package_path
@@ -1,55 +1,129 @@
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from google.cloud import storage
 import google.generativeai as genai
-import os
-from io import BytesIO
+from gemini_limits import GEMINI_INFLIGHT, gemini_retry
+import functools
+import hashlib
+from tempfile import SpooledTemporaryFile
+from typing import BinaryIO, Optional, Tuple
 
-def get_s3_audio_uri(bucket_name: str, object_key: str, aws_access_key: str, aws_secret_key: str) -> BytesIO:
+# Read size used when draining the downloaded audio
+CHUNK_SIZE = 1 << 20
+
+# Audio up to this size stays in memory, larger files spill to disk
+SPOOL_MAX_SIZE = 64 * 1024 * 1024
+
+# Shared botocore settings: pooled keep-alive connections and adaptive retries
+S3_CLIENT_CONFIG = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    retries={'mode': 'adaptive'}
+)
+
+@functools.lru_cache(maxsize=None)
+def get_s3_client(aws_access_key: str, aws_secret_key: str):
+    """
+    Return a connection-pooled S3 client, reused across calls with the same credentials
+    """
+    session = boto3.Session(
+        aws_access_key_id=aws_access_key,
+        aws_secret_access_key=aws_secret_key
+    )
+    return session.client('s3', config=S3_CLIENT_CONFIG)
+
+@functools.lru_cache(maxsize=None)
+def get_storage_client() -> storage.Client:
+    """
+    Return a GCS client shared by the transcription cache lookups and writes
+    """
+    return storage.Client()
+
+@functools.lru_cache(maxsize=None)
+def get_transcription_model(api_key: str) -> genai.GenerativeModel:
+    """
+    Return the Gemini 1.5 Pro transcription model, configured once per API key
+    """
+    # Configure Gemini
+    genai.configure(api_key=api_key)
+    
+    return genai.GenerativeModel(
+        model_name='gemini-1.5-pro',
+        generation_config={
+            'temperature': 0.1,  # Lower temperature for more accurate transcription
+            'top_p': 0.8,
+            'top_k': 40,
+        }
+    )
+
+class HashingWriter:
     """
-    Fetch audio file from S3 and return it as a BytesIO object
+    Write-only file wrapper that updates a SHA-256 digest as bytes pass through
+    
+    It exposes no seek/tell, so boto3 delivers multipart downloads to it in order.
+    """
+    def __init__(self, fileobj: BinaryIO):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+    
+    def write(self, data: bytes) -> int:
+        self.sha256.update(data)
+        return self.fileobj.write(data)
+    
+    def hexdigest(self) -> str:
+        return self.sha256.hexdigest()
+
+def get_s3_audio_uri(
+    bucket_name: str,
+    object_key: str,
+    aws_access_key: str,
+    aws_secret_key: str,
+    io_chunksize: int = 1024 * 1024,
+    max_concurrency: int = 10
+) -> Tuple[BinaryIO, str]:
+    """
+    Fetch audio file from S3 using parallel ranged GETs
+    Returns the rewound file object and the SHA-256 hex digest of its content
     """
     try:
-        # Initialize S3 client
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=aws_access_key,
-            aws_secret_access_key=aws_secret_key
+        # Reuse the pooled S3 client
+        s3_client = get_s3_client(aws_access_key, aws_secret_key)
+        
+        # Multipart download settings, mirroring the AWS CLI defaults for fast links
+        transfer_config = TransferConfig(
+            multipart_threshold=8 * 1024 * 1024,
+            multipart_chunksize=16 * 1024 * 1024,
+            max_concurrency=max_concurrency,
+            io_chunksize=io_chunksize,
+            use_threads=True
         )
         
         # Get the audio file from S3
-        response = s3_client.get_object(Bucket=bucket_name, Key=object_key)
-        audio_data = response['Body'].read()
+        audio_file = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        hashing_writer = HashingWriter(audio_file)
+        s3_client.download_fileobj(
+            Bucket=bucket_name,
+            Key=object_key,
+            Fileobj=hashing_writer,
+            Config=transfer_config
+        )
+        audio_file.seek(0)
         
-        # Convert to BytesIO object
-        return BytesIO(audio_data)
+        return audio_file, hashing_writer.hexdigest()
         
     except ClientError as e:
         print(f"Error accessing S3: {e}")
         raise
 
-def transcribe_audio(audio_data: BytesIO, api_key: str) -> str:
+@gemini_retry
+def generate_transcription(model: genai.GenerativeModel, audio_content: bytes):
     """
-    Transcribe audio using Gemini 1.5 Pro
+    Send audio to Gemini, retrying transient errors within the in-flight limit
     """
-    try:
-        # Configure Gemini
-        genai.configure(api_key=api_key)
-        
-        # Initialize Gemini 1.5 Pro model
-        model = genai.GenerativeModel(
-            model_name='gemini-1.5-pro',
-            generation_config={
-                'temperature': 0.1,  # Lower temperature for more accurate transcription
-                'top_p': 0.8,
-                'top_k': 40,
-            }
-        )
-        
-        # Prepare audio content
-        audio_content = audio_data.getvalue()
-        
-        # Generate transcription
-        response = model.generate_content(
+    with GEMINI_INFLIGHT:
+        return model.generate_content(
             audio_content,
             stream=False,
             safety_settings=[
@@ -63,6 +137,20 @@ def transcribe_audio(audio_data: BytesIO, api_key: str) -> str:
                 }
             ]
         )
+
+def transcribe_audio(audio_data: BinaryIO, api_key: str) -> str:
+    """
+    Transcribe audio using Gemini 1.5 Pro
+    """
+    try:
+        # Reuse the Gemini 1.5 Pro model
+        model = get_transcription_model(api_key)
+        
+        # Prepare audio content, draining the file in fixed-size chunks
+        audio_content = b''.join(iter(lambda: audio_data.read(CHUNK_SIZE), b''))
+        
+        # Generate transcription
+        response = generate_transcription(model, audio_content)
         
         return response.text
         
@@ -70,6 +158,22 @@ def transcribe_audio(audio_data: BytesIO, api_key: str) -> str:
         print(f"Error in transcription: {e}")
         raise
 
+def get_cached_transcription(cache_bucket: str, digest: str, cache_prefix: str = "cache/transcripts") -> Optional[str]:
+    """
+    Return a previously stored transcription for this audio digest, or None on a miss
+    """
+    blob = get_storage_client().bucket(cache_bucket).blob(f"{cache_prefix}/{digest}.txt")
+    if not blob.exists():
+        return None
+    return blob.download_as_text()
+
+def cache_transcription(cache_bucket: str, digest: str, transcription: str, cache_prefix: str = "cache/transcripts"):
+    """
+    Store a transcription under its audio digest
+    """
+    blob = get_storage_client().bucket(cache_bucket).blob(f"{cache_prefix}/{digest}.txt")
+    blob.upload_from_string(transcription, content_type="text/plain")
+
 def main():
     # Configuration
     AWS_ACCESS_KEY = "your_aws_access_key"
@@ -77,21 +181,27 @@ def main():
     BUCKET_NAME = "your_bucket_name"
     OBJECT_KEY = "path/to/your/audio/file.mp3"
     GEMINI_API_KEY = "your_gemini_api_key"
+    CACHE_BUCKET = "your_gcs_cache_bucket"
     
     try:
         # Get audio data from S3
-        audio_data = get_s3_audio_uri(
+        audio_data, audio_digest = get_s3_audio_uri(
             bucket_name=BUCKET_NAME,
             object_key=OBJECT_KEY,
             aws_access_key=AWS_ACCESS_KEY,
             aws_secret_key=AWS_SECRET_KEY
         )
         
-        # Transcribe audio
-        transcription = transcribe_audio(
-            audio_data=audio_data,
-            api_key=GEMINI_API_KEY
-        )
+        # Reuse an earlier transcription of identical audio if there is one
+        transcription = get_cached_transcription(CACHE_BUCKET, audio_digest)
+        
+        if transcription is None:
+            # Transcribe audio
+            transcription = transcribe_audio(
+                audio_data=audio_data,
+                api_key=GEMINI_API_KEY
+            )
+            cache_transcription(CACHE_BUCKET, audio_digest, transcription)
         
         print("Transcription:", transcription)
         
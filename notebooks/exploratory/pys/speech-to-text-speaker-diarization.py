@@ -1,19 +1,33 @@
+import asyncio
 from google.cloud import speech
 from google.cloud.speech_v1 import SpeechClient
 from google.cloud.speech_v1.types import RecognitionConfig, SpeakerDiarizationConfig
-from datetime import datetime, timedelta
+from google.cloud.speech_v1.services.speech.transports import SpeechGrpcTransport
+from datetime import datetime
+import functools
+import numpy as np
 
-def transcribe_with_diarization(audio_uri):
+@functools.lru_cache(maxsize=1)
+def get_speech_client():
     """
-    Transcribe audio with speaker diarization and timing information
+    Return a process-wide SpeechClient so the gRPC channel and credentials are set up once
+    """
+    channel = SpeechGrpcTransport.create_channel(
+        options=[('grpc.max_receive_message_length', -1)]
+    )
+    return speech.SpeechClient(transport=SpeechGrpcTransport(channel=channel))
+
+def start_diarized_recognition(audio_uri):
+    """
+    Submit a long-running recognition request with speaker diarization and word timings
     
     Args:
         audio_uri (str): URI of the audio file to transcribe
         
     Returns:
-        list: List of dictionaries containing speaker segments with timing information
+        Operation: Long-running operation handle for the recognition job
     """
-    client = speech.SpeechClient()
+    client = get_speech_client()
 
     speaker_diarization_config = speech.SpeakerDiarizationConfig(
         enable_speaker_diarization=True,
@@ -33,56 +47,96 @@ def transcribe_with_diarization(audio_uri):
         uri=audio_uri,
     )
 
-    # Perform the transcription
-    response = client.long_running_recognize(
+    # Start the transcription
+    return client.long_running_recognize(
         config=recognition_config,
         audio=audio,
-    ).result()
+    )
+
+def transcribe_with_diarization(audio_uri, timeout=None):
+    """
+    Transcribe audio with speaker diarization and timing information
+    
+    Args:
+        audio_uri (str): URI of the audio file to transcribe
+        timeout (float): Seconds to wait for the recognition job, None waits indefinitely
+        
+    Returns:
+        list: List of dictionaries containing speaker segments with timing information
+    """
+    operation = start_diarized_recognition(audio_uri)
+    return build_speaker_segments(operation.result(timeout=timeout))
 
-    # Process results to get speaker segments with timing
+async def transcribe_with_diarization_async(audio_uri, timeout=None):
+    """
+    Transcribe audio without blocking the event loop, so several files can overlap
+    
+    Args:
+        audio_uri (str): URI of the audio file to transcribe
+        timeout (float): Seconds to wait for the recognition job, None waits indefinitely
+        
+    Returns:
+        list: List of dictionaries containing speaker segments with timing information
+    """
+    loop = asyncio.get_running_loop()
+    operation = await loop.run_in_executor(None, start_diarized_recognition, audio_uri)
+    response = await loop.run_in_executor(None, functools.partial(operation.result, timeout=timeout))
+    return build_speaker_segments(response)
+
+async def transcribe_many_with_diarization(audio_uris, timeout=None):
+    """
+    Transcribe several audio files concurrently
+    
+    Args:
+        audio_uris (list): URIs of the audio files to transcribe
+        timeout (float): Seconds to wait for each recognition job, None waits indefinitely
+        
+    Returns:
+        list: Speaker segments for each URI, in input order
+    """
+    return await asyncio.gather(
+        *(transcribe_with_diarization_async(uri, timeout=timeout) for uri in audio_uris)
+    )
+
+def build_speaker_segments(response):
+    """
+    Group the diarized words of a recognition response into speaker segments
+    
+    Args:
+        response (LongRunningRecognizeResponse): Completed recognition response
+        
+    Returns:
+        list: List of dictionaries containing speaker segments with timing information
+    """
+    # With diarization enabled the last result carries every word with its speaker tag
+    tagged_results = [
+        result for result in response.results
+        if result.alternatives and result.alternatives[0].words
+    ]
+    if not tagged_results:
+        return []
+    words = tagged_results[-1].alternatives[0].words
+
+    word_count = len(words)
+    texts = [word.word for word in words]
+    tags = np.fromiter((word.speaker_tag for word in words), dtype=np.int32, count=word_count)
+    starts = np.fromiter((word.start_time.total_seconds() for word in words), dtype=np.float64, count=word_count)
+    last_end_time = words[-1].end_time.total_seconds()
+
+    # A new segment starts wherever the speaker tag changes
+    boundaries = np.flatnonzero(np.diff(tags)) + 1
+    segment_starts = np.concatenate(([0], boundaries))
+    segment_ends = np.append(boundaries, word_count)
+
+    # Each segment ends where the next speaker starts, the last one at its final word
     speaker_segments = []
-    current_speaker = None
-    segment_start = None
-    current_text = []
-
-    for result in response.results:
-        # Skip results without speaker tags
-        if not result.alternatives[0].words:
-            continue
-
-        words = result.alternatives[0].words
-
-        for word in words:
-            word_start_time = word.start_time.total_seconds()
-            word_end_time = word.end_time.total_seconds()
-            speaker_tag = word.speaker_tag
-
-            # Start new segment if speaker changes or this is the first word
-            if speaker_tag != current_speaker:
-                # Save previous segment if it exists
-                if current_speaker is not None:
-                    speaker_segments.append({
-                        'speaker': f'Speaker {current_speaker}',
-                        'start_time': format_timestamp(segment_start),
-                        'end_time': format_timestamp(word_start_time),
-                        'text': ' '.join(current_text)
-                    })
-
-                # Start new segment
-                current_speaker = speaker_tag
-                segment_start = word_start_time
-                current_text = [word.word]
-            else:
-                current_text.append(word.word)
-
-        # Don't forget to add the last segment
-        if current_text:
-            speaker_segments.append({
-                'speaker': f'Speaker {current_speaker}',
-                'start_time': format_timestamp(segment_start),
-                'end_time': format_timestamp(word_end_time),
-                'text': ' '.join(current_text)
-            })
+    for i, j in zip(segment_starts.tolist(), segment_ends.tolist()):
+        speaker_segments.append({
+            'speaker': f'Speaker {tags[i]}',
+            'start_time': format_timestamp(starts[i]),
+            'end_time': format_timestamp(starts[j] if j < word_count else last_end_time),
+            'text': ' '.join(texts[i:j])
+        })
 
     return speaker_segments
 
@@ -90,16 +144,17 @@ def format_timestamp(seconds):
     """
     Format seconds into HH:MM:SS.mmm
     """
-    time = str(timedelta(seconds=seconds))
-    # Ensure consistent formatting
-    if '.' not in time:
-        time += '.000'
-    else:
-        time = time[:-3]  # Truncate to milliseconds
-    # Pad hours if necessary
-    if len(time.split(':')[0]) == 1:
-        time = '0' + time
-    return time
+    return _format_milliseconds(round(seconds * 1000))
+
+@functools.lru_cache(maxsize=4096)
+def _format_milliseconds(total_ms):
+    """
+    Format whole milliseconds into HH:MM:SS.mmm using integer arithmetic only
+    """
+    hours, rem = divmod(total_ms, 3_600_000)
+    minutes, rem = divmod(rem, 60_000)
+    secs, ms = divmod(rem, 1000)
+    return f'{hours:02}:{minutes:02}:{secs:02}.{ms:03}'
 
 # Example usage
 if __name__ == "__main__":
@@ -1,41 +1,48 @@
+import functools
 import json
-from typing import Dict, List, Optional
-from pydantic import BaseModel, Field
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Union
+import orjson
+from pydantic import BaseModel, ConfigDict, Field
 import google.generativeai as genai
+from gemini_limits import GEMINI_INFLIGHT, gemini_retry
 from datetime import datetime
 
 # Pydantic models for validation
 class CallSummary(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    
     summary: str = Field(..., max_length=500)
-    key_points: List[str] = Field(..., max_items=5)
+    key_points: List[str] = Field(..., max_length=5)
     outcome: str = Field(..., max_length=200)
-    follow_up_recommendations: List[str] = Field(..., max_items=3)
+    follow_up_recommendations: List[str] = Field(..., max_length=3)
 
 class CallTopic(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    
     primary_topic: str = Field(..., max_length=100)
     category: str = Field(..., max_length=100)
     sub_category: str = Field(..., max_length=100)
 
 class AgentCoaching(BaseModel):
-    strengths: List[str] = Field(..., max_items=3)
-    improvement_areas: List[str] = Field(..., max_items=3)
-    specific_recommendations: List[str] = Field(..., max_items=4)
-    skill_development_focus: List[str] = Field(..., max_items=3)
+    model_config = ConfigDict(extra='forbid')
+    
+    strengths: List[str] = Field(..., max_length=3)
+    improvement_areas: List[str] = Field(..., max_length=3)
+    specific_recommendations: List[str] = Field(..., max_length=4)
+    skill_development_focus: List[str] = Field(..., max_length=3)
 
 class TranscriptAnalysis(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    
     call_summary: CallSummary
     call_topic: CallTopic
     agent_coaching: AgentCoaching
 
-class KPIExtractor:
-    def __init__(self, api_key: str):
-        """Initialize Gemini API and configure the model"""
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
-        
-    def create_prompt(self, transcript: str) -> str:
-        """Create a structured prompt for KPI extraction"""
-        return f"""
+# KPI extraction prompt, split around the transcript so each call is a plain concatenation
+_KPI_PROMPT_PREFIX = """
         Analyze this call transcript and provide a structured analysis in the exact JSON format specified below.
         Keep responses concise, specific, and actionable.
 
@@ -48,28 +55,30 @@ class KPIExtractor:
         - All text fields must be clear, professional, and free of fluff
 
         Transcript:
-        {transcript}
+        """
+
+_KPI_PROMPT_SUFFIX = """
 
         Required Output Structure:
-        {{
-            "call_summary": {{
+        {
+            "call_summary": {
                 "summary": "3-4 line overview of the call",
                 "key_points": ["Point 1", "Point 2", "Point 3", "Point 4", "Point 5"],
                 "outcome": "Clear statement of call resolution",
                 "follow_up_recommendations": ["Rec 1", "Rec 2", "Rec 3"]
-            }},
-            "call_topic": {{
+            },
+            "call_topic": {
                 "primary_topic": "Main topic of discussion",
                 "category": "Business category",
                 "sub_category": "Specific sub-category"
-            }},
-            "agent_coaching": {{
+            },
+            "agent_coaching": {
                 "strengths": ["Strength 1", "Strength 2", "Strength 3"],
                 "improvement_areas": ["Area 1", "Area 2", "Area 3"],
                 "specific_recommendations": ["Rec 1", "Rec 2", "Rec 3", "Rec 4"],
                 "skill_development_focus": ["Skill 1", "Skill 2", "Skill 3"]
-            }}
-        }}
+            }
+        }
 
         Rules:
         1. Maintain exact JSON structure
@@ -79,9 +88,30 @@ class KPIExtractor:
         5. Keep all text concise and professional
         """
 
-    def validate_response(self, response_json: Dict) -> TranscriptAnalysis:
-        """Validate the response using Pydantic models"""
-        return TranscriptAnalysis(**response_json)
+@functools.lru_cache(maxsize=None)
+def get_gemini_model(api_key: str, model_name: str = 'gemini-pro') -> genai.GenerativeModel:
+    """Configure Gemini once per API key and share the model across extractors and threads"""
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
+
+class KPIExtractor:
+    def __init__(self, api_key: str):
+        """Initialize Gemini API and configure the model"""
+        self.model = get_gemini_model(api_key)
+        
+    def create_prompt(self, transcript: str) -> str:
+        """Create a structured prompt for KPI extraction"""
+        return _KPI_PROMPT_PREFIX + transcript + _KPI_PROMPT_SUFFIX
+
+    @gemini_retry
+    def generate(self, prompt: str):
+        """Send a prompt to Gemini, retrying transient errors within the in-flight limit"""
+        with GEMINI_INFLIGHT:
+            return self.model.generate_content(prompt)
+
+    def validate_response(self, response_text: str) -> TranscriptAnalysis:
+        """Parse and validate the raw JSON response in one pass using Pydantic models"""
+        return TranscriptAnalysis.model_validate_json(response_text)
 
     def extract_kpis(self, transcript: str) -> Optional[Dict]:
         """
@@ -98,40 +128,73 @@ class KPIExtractor:
             prompt = self.create_prompt(transcript)
             
             # Get response from Gemini
-            response = self.model.generate_content(prompt)
+            response = self.generate(prompt)
             
-            # Parse JSON response
-            response_json = json.loads(response.text)
+            # Parse and validate response structure
+            validated_response = self.validate_response(response.text)
             
-            # Validate response structure
-            validated_response = self.validate_response(response_json)
-            
-            return validated_response.dict()
+            return validated_response.model_dump()
             
         except Exception as e:
             print(f"Error extracting KPIs: {str(e)}")
             return None
 
+class RateLimiter:
+    """Thread-safe limiter spacing calls to at most max_qps per second"""
+    def __init__(self, max_qps: Optional[float] = None):
+        self.interval = 1.0 / max_qps if max_qps else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+    
+    def wait(self):
+        """Block until the caller may issue the next request"""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
 class KPIProcessor:
-    def __init__(self, extractor: KPIExtractor):
+    def __init__(self, extractor: KPIExtractor, max_workers: int = 8, max_qps: Optional[float] = None):
         self.extractor = extractor
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(max_qps)
+    
+    def _extract(self, transcript: str) -> Optional[Dict]:
+        """Extract KPIs for one transcript, respecting the rate limit"""
+        self.rate_limiter.wait()
+        return self.extractor.extract_kpis(transcript)
         
     def process_batch(self, transcripts: List[str]) -> List[Dict]:
-        """Process a batch of transcripts"""
-        results = []
-        for transcript in transcripts:
-            kpis = self.extractor.extract_kpis(transcript)
-            if kpis:
-                results.append(kpis)
-        return results
+        """Process a batch of transcripts concurrently, preserving input order"""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return [kpis for kpis in executor.map(self._extract, transcripts) if kpis]
+    
+    @staticmethod
+    def _serialize_default(obj: Any) -> Any:
+        """Fallback for values orjson cannot encode natively, such as unconverted Pydantic models"""
+        if isinstance(obj, BaseModel):
+            return obj.model_dump()
+        raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
     
-    def save_results(self, results: List[Dict], filename: str = None):
-        """Save results to JSON file"""
+    def save_results(self, results: List[Union[Dict, TranscriptAnalysis]], filename: str = None) -> str:
+        """Save results to JSON file and return its name"""
         if filename is None:
             filename = f"kpi_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
         
-        with open(filename, 'w') as f:
-            json.dump(results, f, indent=2)
+        # Serialize the whole batch in one C-level pass and write the bytes in a single call
+        payload = orjson.dumps(
+            results,
+            default=self._serialize_default,
+            option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE
+        )
+        with open(filename, 'wb') as f:
+            f.write(payload)
+        
+        return filename
 
 # Example usage
 if __name__ == "__main__":
@@ -2,9 +2,9 @@
 Vertex AI Pipeline definition for Voice Analysis System
 """
 from kfp import dsl
-from kfp.v2 import compiler
 from google.cloud import aiplatform
 from typing import NamedTuple
+from pipeline_compile import compile_pipeline
 
 # Pipeline component for loading and validating configurations
 @dsl.component(
@@ -156,10 +156,7 @@ def create_pipeline_job(
     pipeline_name: str
 ):
     """Create and submit pipeline job"""
-    compiler.Compiler().compile(
-        pipeline_func=voice_analysis_pipeline,
-        package_path='voice_analysis_pipeline.json'
-    )
+    template_path = compile_pipeline(voice_analysis_pipeline, __file__)
 
     # Initialize Vertex AI
     aiplatform.init(
@@ -170,7 +167,7 @@ def create_pipeline_job(
     # Create pipeline job
     job = aiplatform.PipelineJob(
         display_name=pipeline_name,
-        template_path='voice_analysis_pipeline.json',
+        template_path=template_path,
         pipeline_root=pipeline_root,
         parameter_values={
             'project_id': project_id,
@@ -1,12 +1,94 @@
+import asyncio
+import functools
+import hashlib
+import json
 import vertexai
 from vertexai.language_models import TextGenerationModel
 from google.cloud import storage
+from gemini_limits import GEMINI_INFLIGHT, gemini_retry
+from collections import OrderedDict
 from typing import Dict, Any
 
+# Number of fused analyses kept per analyzer, keyed by transcript digest
+ANALYSIS_CACHE_SIZE = 128
+
+# Fused analysis prompt, split around the transcript so each call is a plain concatenation
+_ANALYSIS_PROMPT_PREFIX = """
+        Analyze the following call transcript and provide, in one JSON object:
+        
+        topic:
+        1. Primary Call Topic
+        2. Detailed Category and Sub-Category
+        3. Confidence Score for Topic Identification
+        
+        summary:
+        - Concise overview (max 3-4 sentences)
+        - Key discussion points
+        - Outcome or resolution
+        - Recommended follow-up actions
+        
+        sentiment:
+        - Analyze sentiment for each significant segment
+        - Provide probability scores
+        - Identify emotional transitions
+        
+        coaching:
+        - Communication effectiveness
+        - Problem-solving approach
+        - Customer handling techniques
+        - Areas of improvement
+
+        Transcript: """
+
+_ANALYSIS_PROMPT_SUFFIX = """
+        
+        Output Format (JSON):
+        {
+            "topic": {
+                "primary_topic": "",
+                "category": "",
+                "sub_category": "",
+                "confidence_score": 0.0
+            },
+            "summary": {
+                "summary": "",
+                "key_points": [],
+                "outcome": "",
+                "follow_up_recommendations": []
+            },
+            "sentiment": {
+                "segments": [
+                    {
+                        "text": "",
+                        "sentiment": "",
+                        "probability_score": 0.0
+                    }
+                ],
+                "overall_sentiment": "",
+                "emotional_progression": []
+            },
+            "coaching": {
+                "strengths": [],
+                "improvement_areas": [],
+                "specific_recommendations": [],
+                "skill_development_focus": []
+            }
+        }
+        """
+
+@functools.lru_cache(maxsize=None)
+def get_text_model(project_id: str, location: str) -> TextGenerationModel:
+    """
+    Initialize Vertex AI and load the text model once per project and location
+    """
+    vertexai.init(project=project_id, location=location)
+    return TextGenerationModel.from_pretrained("text-bison@002")
+
 class VoiceCallAnalyzer:
     def __init__(self, project_id: str, location: str):
-        vertexai.init(project=project_id, location=location)
-        self.model = TextGenerationModel.from_pretrained("text-bison@002")
+        self.model = get_text_model(project_id, location)
+        # Fused analyses keyed by transcript digest, served to the per-section views
+        self._analysis_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
     
     def preprocess_audio(self, audio_uri: str) -> str:
         """
@@ -17,107 +99,45 @@ class VoiceCallAnalyzer:
         # Implement Speech-to-Text conversion
         pass
     
-    def extract_call_topic(self, transcript: str) -> Dict[str, Any]:
+    def create_analysis_prompt(self, transcript: str) -> str:
         """
-        Modular prompt for extracting call topic
+        Single prompt covering topic, summary, sentiment and coaching
         """
-        prompt = f"""
-        Analyze the following call transcript and identify:
-        1. Primary Call Topic
-        2. Detailed Category and Sub-Category
-        3. Confidence Score for Topic Identification
-
-        Transcript: {transcript}
-        
-        Output Format (JSON):
-        {{
-            "primary_topic": "",
-            "category": "",
-            "sub_category": "",
-            "confidence_score": 0.0
-        }}
+        return _ANALYSIS_PROMPT_PREFIX + transcript + _ANALYSIS_PROMPT_SUFFIX
+    
+    def extract_call_topic(self, transcript: str) -> Dict[str, Any]:
         """
-        
-        response = self.model.predict(prompt, max_output_tokens=1024)
-        return self.parse_json_response(response.text)
+        Call topic view over the fused analysis
+        """
+        return self.analyze_transcript(transcript).get("topic", {})
     
     def generate_call_summary(self, transcript: str) -> Dict[str, Any]:
         """
-        Modular prompt for generating call summary
+        Call summary view over the fused analysis
         """
-        prompt = f"""
-        Provide a comprehensive summary of the following call transcript:
-        - Concise overview (max 3-4 sentences)
-        - Key discussion points
-        - Outcome or resolution
-        - Recommended follow-up actions
-
-        Transcript: {transcript}
-        
-        Output Format (JSON):
-        {{
-            "summary": "",
-            "key_points": [],
-            "outcome": "",
-            "follow_up_recommendations": []
-        }}
-        """
-        
-        response = self.model.predict(prompt, max_output_tokens=1024)
-        return self.parse_json_response(response.text)
+        return self.analyze_transcript(transcript).get("summary", {})
     
     def analyze_sentiment(self, transcript: str) -> Dict[str, Any]:
         """
-        Detailed sentiment analysis per caption/segment
-        """
-        prompt = f"""
-        Perform multi-level sentiment analysis on the call transcript:
-        - Analyze sentiment for each significant segment
-        - Provide probability scores
-        - Identify emotional transitions
-
-        Transcript: {transcript}
-        
-        Output Format (JSON):
-        {{
-            "segments": [
-                {{
-                    "text": "",
-                    "sentiment": "",
-                    "probability_score": 0.0
-                }}
-            ],
-            "overall_sentiment": "",
-            "emotional_progression": []
-        }}
+        Sentiment view over the fused analysis
         """
-        
-        response = self.model.predict(prompt, max_output_tokens=1024)
-        return self.parse_json_response(response.text)
+        return self.analyze_transcript(transcript).get("sentiment", {})
     
     def generate_coaching_points(self, transcript: str) -> Dict[str, Any]:
         """
-        Generate actionable coaching points for the agent
+        Agent coaching view over the fused analysis
         """
-        prompt = f"""
-        Identify agent coaching opportunities from the transcript:
-        - Communication effectiveness
-        - Problem-solving approach
-        - Customer handling techniques
-        - Areas of improvement
-
-        Transcript: {transcript}
-        
-        Output Format (JSON):
-        {{
-            "strengths": [],
-            "improvement_areas": [],
-            "specific_recommendations": [],
-            "skill_development_focus": []
-        }}
+        return self.analyze_transcript(transcript).get("coaching", {})
+    
+    @gemini_retry
+    def _predict(self, prompt: str) -> Dict[str, Any]:
         """
-        
-        response = self.model.predict(prompt, max_output_tokens=1024)
+        Send a single prompt to the model and parse the JSON reply
+        - Retried with jittered backoff on quota and transient errors
+        - Bounded by the process-wide in-flight limit
+        """
+        with GEMINI_INFLIGHT:
+            response = self.model.predict(prompt, max_output_tokens=2048)
         return self.parse_json_response(response.text)
     
     def parse_json_response(self, response: str) -> Dict[str, Any]:
@@ -130,22 +150,54 @@ class VoiceCallAnalyzer:
             # Implement fallback parsing or error logging
             return {}
     
-    def process_voice_call(self, audio_uri: str) -> Dict[str, Any]:
-        """
-        Orchestrate the entire analysis pipeline
-        """
-        # Preprocessing
-        transcript = self.preprocess_audio(audio_uri)
+    async def analyze_transcript_async(self, transcript: str) -> Dict[str, Any]:
+        """
+        Analyze the transcript with a single fused prompt
+        - The transcript is sent to the model once instead of once per section
+        - The Vertex SDK is synchronous, so the call runs in a worker thread
+        - Results are cached by transcript digest, so re-analysis skips the model
+        - Failed (unparseable) analyses are not cached, so the next call retries the model
+        """
+        digest = hashlib.sha256(transcript.encode("utf-8")).hexdigest()
+        if digest in self._analysis_cache:
+            self._analysis_cache.move_to_end(digest)
+            return self._analysis_cache[digest]
         
-        # Parallel analysis using separate modular prompts
+        analysis = await asyncio.to_thread(self._predict, self.create_analysis_prompt(transcript))
         results = {
-            "topic": self.extract_call_topic(transcript),
-            "summary": self.generate_call_summary(transcript),
-            "sentiment": self.analyze_sentiment(transcript),
-            "coaching": self.generate_coaching_points(transcript)
+            "topic": analysis.get("topic", {}),
+            "summary": analysis.get("summary", {}),
+            "sentiment": analysis.get("sentiment", {}),
+            "coaching": analysis.get("coaching", {})
         }
         
+        if analysis:
+            self._analysis_cache[digest] = results
+            if len(self._analysis_cache) > ANALYSIS_CACHE_SIZE:
+                self._analysis_cache.popitem(last=False)
         return results
+    
+    def analyze_transcript(self, transcript: str) -> Dict[str, Any]:
+        """
+        Synchronous wrapper around analyze_transcript_async
+        """
+        return asyncio.run(self.analyze_transcript_async(transcript))
+    
+    async def process_voice_call_async(self, audio_uri: str) -> Dict[str, Any]:
+        """
+        Orchestrate the entire analysis pipeline
+        """
+        # Preprocessing
+        transcript = await asyncio.to_thread(self.preprocess_audio, audio_uri)
+        
+        # Fused analysis covering all four sections
+        return await self.analyze_transcript_async(transcript)
+    
+    def process_voice_call(self, audio_uri: str) -> Dict[str, Any]:
+        """
+        Synchronous wrapper around process_voice_call_async
+        """
+        return asyncio.run(self.process_voice_call_async(audio_uri))
 
 # Vertex AI Pipeline Integration
 def voice_call_analysis_pipeline():
@@ -163,12 +215,7 @@ def voice_call_analysis_pipeline():
     @vertex_ai.component
     def analysis_component(transcript: str) -> Dict[str, Any]:
         analyzer = VoiceCallAnalyzer(project_id, location)
-        return {
-            "topic": analyzer.extract_call_topic(transcript),
-            "summary": analyzer.generate_call_summary(transcript),
-            "sentiment": analyzer.analyze_sentiment(transcript),
-            "coaching": analyzer.generate_coaching_points(transcript)
-        }
+        return analyzer.analyze_transcript(transcript)
     
     # Pipeline definition
     pipeline = vertex_ai.PipelineJob(
@@ -1,117 +1,557 @@
 from kfp import dsl
 from kfp.v2 import compiler
 from google.cloud import aiplatform
-from typing import List, Dict
-import boto3
-import json
+from typing import List, NamedTuple
+import hashlib
+import os
+import tempfile
+
+# Compiled pipeline spec shared by on-demand runs and the schedule
+PIPELINE_TEMPLATE_URI = "gs://your-bucket/pipeline_templates/transcript_pipeline.json"
+
+# Concurrent batch workers, fixed at compile time; size to the Snowflake warehouse
+# and Gemini quota/Provisioned Throughput the pipeline runs against
+MAX_PARALLEL_EXECUTIONS = int(os.environ.get("TRANSCRIPT_MAX_PARALLEL_EXECUTIONS", "10"))
+
+# Pre-baked image with every component dependency (see transcript-worker.Dockerfile)
+WORKER_IMAGE = "us-central1-docker.pkg.dev/your-project/your-repo/transcript-worker:v1"
 
 # Component for listing new transcripts
-@dsl.component(
-    base_image="python:3.9",
-    packages_to_install=["boto3", "google-cloud-storage"]
-)
+@dsl.component(base_image=WORKER_IMAGE, install_kfp_package=False)
 def list_new_transcripts(
-    aws_access_key_id: str,
-    aws_secret_key: str,
+    aws_role_arn: str,
     source_bucket: str,
-    time_window_hours: int = 2
+    time_window_hours: int = 2,
+    key_prefix_format: str = "",
+    hex_shard_width: int = 0,
+    max_list_workers: int = 16,
+    aws_token_audience: str = "sts.amazonaws.com"
 ) -> List[str]:
     import boto3
+    import google.auth.transport.requests
+    from botocore.config import Config
+    from concurrent.futures import ThreadPoolExecutor, as_completed
     from datetime import datetime, timedelta
+    from google.oauth2 import id_token
     
+    # Exchange the pod service account's Google-signed token for short-lived AWS credentials
+    web_identity_token = id_token.fetch_id_token(
+        google.auth.transport.requests.Request(),
+        aws_token_audience
+    )
+    aws_credentials = boto3.client('sts').assume_role_with_web_identity(
+        RoleArn=aws_role_arn,
+        RoleSessionName="transcript-listing",
+        WebIdentityToken=web_identity_token
+    )['Credentials']
+    
+    # One thread-safe client shared by all listing threads, with a pool sized to match
     s3_client = boto3.client(
         's3',
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_key
+        aws_access_key_id=aws_credentials['AccessKeyId'],
+        aws_secret_access_key=aws_credentials['SecretAccessKey'],
+        aws_session_token=aws_credentials['SessionToken'],
+        config=Config(max_pool_connections=max(32, max_list_workers))
     )
     
     # List files modified in the last n hours
     time_threshold = datetime.utcnow() - timedelta(hours=time_window_hours)
     
-    response = s3_client.list_objects_v2(Bucket=source_bucket)
-    new_files = [
-        obj['Key'] for obj in response.get('Contents', [])
-        if obj['LastModified'].replace(tzinfo=None) > time_threshold
-        and obj['Key'].endswith('.json')
-    ]
+    # For buckets keyed by upload time (e.g. key_prefix_format="%Y/%m/%d/%H/"), only list
+    # the hourly prefixes covering the window; otherwise fall back to a full bucket scan
+    if key_prefix_format:
+        prefixes = sorted({
+            (time_threshold + timedelta(hours=hour)).strftime(key_prefix_format)
+            for hour in range(time_window_hours + 1)
+        })
+    else:
+        prefixes = [""]
+    
+    # Optionally fan each prefix out over hex-hashed sub-prefixes (00-ff for width 2)
+    if hex_shard_width:
+        prefixes = [
+            f"{prefix}{shard:0{hex_shard_width}x}"
+            for prefix in prefixes
+            for shard in range(16 ** hex_shard_width)
+        ]
+    
+    def list_shard(prefix: str) -> List[str]:
+        paginator = s3_client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(
+            Bucket=source_bucket,
+            Prefix=prefix,
+            PaginationConfig={'PageSize': 1000}
+        )
+        return [
+            obj['Key']
+            for page in pages
+            for obj in page.get('Contents', ())
+            if obj['Key'].endswith(('.json', '.json.gz', '.json.zst'))
+            and obj['LastModified'].replace(tzinfo=None) > time_threshold
+        ]
     
-    return new_files
+    # Listing is latency-bound, so run one paginator per prefix concurrently
+    new_files = []
+    with ThreadPoolExecutor(max_workers=max_list_workers) as executor:
+        futures = [executor.submit(list_shard, prefix) for prefix in prefixes]
+        for future in as_completed(futures):
+            new_files.extend(future.result())
+    
+    return sorted(new_files)
 
-# Component for processing single transcript
-@dsl.component(
-    base_image="python:3.9",
-    packages_to_install=[
-        "boto3",
-        "google-cloud-storage",
-        "google-cloud-aiplatform",
-        "pandas",
-        "snowflake-connector-python"
-    ]
-)
-def process_transcript(
-    transcript_key: str,
-    aws_access_key_id: str,
-    aws_secret_key: str,
+# Component for collecting transcript keys that failed in earlier runs
+@dsl.component(base_image=WORKER_IMAGE, install_kfp_package=False)
+def collect_dead_letters(
+    destination_bucket: str
+) -> NamedTuple('Outputs', [
+    ('transcript_keys', List[str]),
+    ('dead_letter_attempts', dict),
+    ('dead_letter_blobs', List[str]),
+    ('destination_bucket', str)
+]):
+    from collections import namedtuple
+    import orjson
+    from google.cloud import storage
+    
+    # Failed attempts so far per key, so keys that keep failing can be retired
+    dead_letter_attempts = {}
+    dead_letter_blobs = []
+    for blob in storage.Client().list_blobs(destination_bucket, prefix="dlq/"):
+        # Retired keys under dlq/poison/ are kept for inspection, never replayed
+        if blob.name.startswith("dlq/poison/") or not blob.name.endswith(".json"):
+            continue
+        dead_letter = orjson.loads(blob.download_as_bytes())
+        for failure in dead_letter["failures"]:
+            dead_letter_attempts[failure["key"]] = max(
+                dead_letter_attempts.get(failure["key"], 0),
+                failure.get("attempts", 1)
+            )
+        dead_letter_blobs.append(blob.name)
+    transcript_keys = sorted(dead_letter_attempts)
+    
+    # The bucket is echoed so delete_dead_letters, which waits on the ParallelFor, only
+    # consumes task outputs (older kfp compilers reject raw pipeline parameters there)
+    outputs = namedtuple('Outputs', ['transcript_keys', 'dead_letter_attempts', 'dead_letter_blobs', 'destination_bucket'])
+    return outputs(transcript_keys, dead_letter_attempts, dead_letter_blobs, destination_bucket)
+
+# Component for splitting transcript keys into per-worker batches
+@dsl.component(base_image=WORKER_IMAGE, install_kfp_package=False)
+def chunk_list_for_parallelism(
+    files: List[str],
+    retry_files: List[str],
+    chunk_size: int
+) -> List[List[str]]:
+    # Replayed dead letters may also fall inside the listing window, so drop duplicates
+    files = list(dict.fromkeys(files + retry_files))
+    return [files[i:i + chunk_size] for i in range(0, len(files), chunk_size)]
+
+# Component for deleting dead letters once their keys have been reprocessed
+@dsl.component(base_image=WORKER_IMAGE, install_kfp_package=False)
+def delete_dead_letters(
+    destination_bucket: str,
+    dead_letter_blobs: List[str]
+):
+    from google.cloud import storage
+    
+    bucket = storage.Client().bucket(destination_bucket)
+    # Keys that failed again were re-written under this run's dlq/ entry, so the
+    # consumed entries are safe to drop; ignore any already removed
+    bucket.delete_blobs(
+        [bucket.blob(name) for name in dead_letter_blobs],
+        on_error=lambda blob: None
+    )
+
+# Component for processing a batch of transcripts in one pod
+@dsl.component(base_image=WORKER_IMAGE, install_kfp_package=False)
+def process_transcript_batch(
+    transcript_keys: List[str],
+    aws_role_arn: str,
     source_bucket: str,
     gcp_project: str,
     gcp_location: str,
     destination_bucket: str,
-    snowflake_credentials: dict
+    snowflake_secret: str,
+    run_id: str,
+    task_id: str,
+    dead_letter_attempts: dict,
+    aws_token_audience: str = "sts.amazonaws.com",
+    max_dead_letter_attempts: int = 5,
+    batch_prediction_min_size: int = 50,
+    max_inflight_requests: int = 16,
+    llm_request_type: str = "",
+    model_name: str = "gemini-pro",
+    light_model_name: str = "",
+    light_model_max_chars: int = 4000
 ) -> str:
-    import pandas as pd
-    from google.cloud import storage, aiplatform
-    from google.cloud.aiplatform.gapic.schema import predict
-    import snowflake.connector
+    import asyncio
+    import functools
+    import gzip
+    import json
+    import os
+    import tempfile
+    import time
+    import uuid
+    import boto3
+    import google.auth.transport.requests
+    import orjson
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import vertexai
+    import zstandard
+    from botocore.config import Config
+    from concurrent.futures import ThreadPoolExecutor
+    from google.api_core.exceptions import DeadlineExceeded, InternalServerError, ResourceExhausted, ServiceUnavailable
+    from google.cloud import secretmanager, storage
+    from google.oauth2 import id_token
+    from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+    from typing import Union
+    from vertexai.batch_prediction import BatchPredictionJob
+    from vertexai.generative_models import GenerationConfig, GenerativeModel
     
-    # Download and process transcript
+    # Per-pod setup, paid once for the whole batch: no long-lived AWS keys, the pod's
+    # Google-signed identity token is exchanged for short-lived credentials
+    web_identity_token = id_token.fetch_id_token(
+        google.auth.transport.requests.Request(),
+        aws_token_audience
+    )
+    aws_credentials = boto3.client('sts').assume_role_with_web_identity(
+        RoleArn=aws_role_arn,
+        RoleSessionName="transcript-processing",
+        WebIdentityToken=web_identity_token
+    )['Credentials']
     s3_client = boto3.client(
         's3',
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_key
+        aws_access_key_id=aws_credentials['AccessKeyId'],
+        aws_secret_access_key=aws_credentials['SecretAccessKey'],
+        aws_session_token=aws_credentials['SessionToken'],
+        config=Config(
+            max_pool_connections=64,
+            retries={'max_attempts': 10, 'mode': 'adaptive'}
+        )
     )
     
-    response = s3_client.get_object(
-        Bucket=source_bucket,
-        Key=transcript_key
+    # Online requests use Provisioned Throughput when reserved, spilling over to on-demand
+    # quota by default; "dedicated" pins them to the reservation, "shared" to on-demand
+    request_metadata = []
+    if llm_request_type:
+        request_metadata.append(("x-vertex-ai-llm-request-type", llm_request_type))
+    vertexai.init(
+        project=gcp_project,
+        location=gcp_location,
+        request_metadata=request_metadata
     )
-    transcript_data = json.loads(response['Body'].read().decode('utf-8'))
     
-    # Process with Gemini
-    aiplatform.init(project=gcp_project, location=gcp_location)
-    model = aiplatform.GenerativeModel('gemini-pro')
+    # Constrain Gemini to the analysis keys so replies parse on the first call
+    analysis_schema = {
+        'type': 'OBJECT',
+        'properties': {
+            'Topic': {'type': 'STRING'},
+            'Category': {'type': 'STRING'},
+            'Sentiment': {'type': 'STRING'},
+            'KeyIssues': {'type': 'ARRAY', 'items': {'type': 'STRING'}}
+        },
+        'required': ['Topic', 'Category', 'Sentiment', 'KeyIssues']
+    }
     
-    # Combine transcript text
-    full_text = ' '.join([t['Content'] for t in transcript_data['Transcript']])
+    # Built once per pod; each transcript only fills in the conversation
+    prompt_template = """Analyze this customer service conversation and provide:
+            1. Topic
+            2. Category
+            3. Sentiment
+            4. Key issues
+        
+            Conversation: {text}
+        
+            Respond in JSON format with these keys."""
     
-    response = model.generate_content(
-        f"""Analyze this customer service conversation and provide:
-        1. Topic
-        2. Category
-        3. Sentiment
-        4. Key issues
+    @functools.lru_cache(maxsize=None)
+    def get_model(model_name: str) -> GenerativeModel:
+        # One handle per routed model, reused for every call in the batch
+        return GenerativeModel(
+            model_name,
+            generation_config=GenerationConfig(
+                response_mime_type='application/json',
+                response_schema=analysis_schema
+            )
+        )
+    
+    def fetch_transcript(transcript_key: str) -> dict:
+        response = s3_client.get_object(
+            Bucket=source_bucket,
+            Key=transcript_key
+        )
+        body = response['Body'].read()
         
-        Conversation: {full_text}
+        # Producers may store compressed JSON to cut transfer size
+        if response.get('ContentEncoding') == 'gzip' or transcript_key.endswith('.gz'):
+            body = gzip.decompress(body)
+        elif response.get('ContentEncoding') == 'zstd' or transcript_key.endswith('.zst'):
+            # Stream decoding also handles frames written without a content size
+            body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
         
-        Respond in JSON format with these keys."""
-    )
+        # orjson parses the raw bytes directly, skipping the decode copy
+        return orjson.loads(body)
     
-    analysis = json.loads(response.text)
+    def parse_analysis(reply: str) -> dict:
+        try:
+            return orjson.loads(reply)
+        except orjson.JSONDecodeError:
+            # Malformed model output, e.g. JSON wrapped in markdown fences
+            return json.loads(reply.strip().removeprefix("```json").strip("`\n "))
     
-    # Create DataFrame with analysis
-    df = pd.DataFrame(transcript_data['Transcript'])
-    for key, value in analysis.items():
-        df[key] = value
+    # Both analyze helpers return one entry per prompt: the reply text, or the exception
+    # that prompt failed with, so callers dead-letter failures per transcript
+    def analyze_with_batch_job(prompts: List[str], model_name: str) -> List[Union[str, Exception]]:
+        # Stage all requests as one JSONL file for Vertex batch inference
+        storage_client = storage.Client()
+        bucket = storage_client.bucket(destination_bucket)
+        job_prefix = f"batch_prediction/{uuid.uuid4().hex}"
+        bucket.blob(f"{job_prefix}/input.jsonl").upload_from_string(
+            "\n".join(
+                json.dumps({"request": {
+                    "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                    "generationConfig": {
+                        "responseMimeType": "application/json",
+                        "responseSchema": analysis_schema
+                    }
+                }})
+                for prompt in prompts
+            )
+        )
+        
+        job = BatchPredictionJob.submit(
+            source_model=model_name,
+            input_dataset=f"gs://{destination_bucket}/{job_prefix}/input.jsonl",
+            output_uri_prefix=f"gs://{destination_bucket}/{job_prefix}/output"
+        )
+        while not job.has_ended:
+            time.sleep(30)
+            job.refresh()
+        if not job.has_succeeded:
+            raise RuntimeError(f"Batch prediction job failed: {job.error}")
+        
+        # Output rows echo their request, so replies are matched back to prompts by text
+        replies = {}
+        output_bucket, output_prefix = job.output_location[len("gs://"):].split("/", 1)
+        for blob in storage_client.list_blobs(output_bucket, prefix=output_prefix):
+            if not blob.name.endswith(".jsonl"):
+                continue
+            for line in blob.download_as_text().splitlines():
+                try:
+                    row = orjson.loads(line)
+                    prompt = row["request"]["contents"][0]["parts"][0]["text"]
+                except (orjson.JSONDecodeError, KeyError, IndexError, TypeError):
+                    # An unmatched row leaves its prompt without a reply, reported below
+                    continue
+                # Failed or safety-blocked rows carry no candidate text; only that prompt fails,
+                # like return_exceptions=True on the online path
+                try:
+                    replies[prompt] = row["response"]["candidates"][0]["content"]["parts"][0]["text"]
+                except (KeyError, IndexError, TypeError) as e:
+                    replies[prompt] = RuntimeError(
+                        f"No text in batch prediction output ({row.get('status') or repr(e)})"
+                    )
+        
+        return [
+            replies.get(prompt, RuntimeError("No batch prediction response returned"))
+            for prompt in prompts
+        ]
     
-    # Save to Snowflake
-    with snowflake.connector.connect(**snowflake_credentials) as conn:
-        success, nchunks, nrows, _ = write_pandas(
-            conn,
-            df,
-            'processed_transcripts',
-            auto_create_table=True
+    async def analyze_concurrently(prompts: List[str], model_name: str) -> List[Union[str, Exception]]:
+        model = get_model(model_name)
+        semaphore = asyncio.Semaphore(max_inflight_requests)
+        
+        # Retry quota and transient server errors only; the semaphore is released while backing off
+        @retry(
+            retry=retry_if_exception_type((
+                ResourceExhausted,
+                ServiceUnavailable,
+                DeadlineExceeded,
+                InternalServerError
+            )),
+            stop=stop_after_attempt(3),
+            wait=wait_exponential_jitter(),
+            reraise=True
+        )
+        async def analyze(prompt: str) -> str:
+            async with semaphore:
+                response = await model.generate_content_async(prompt)
+                return response.text
+        
+        # A failed prompt comes back as its exception so the rest of the batch survives
+        return await asyncio.gather(*(analyze(prompt) for prompt in prompts), return_exceptions=True)
+    
+    # Record per-transcript failures instead of aborting the batch; KFP would otherwise
+    # retry the whole task and repeat the work that already succeeded
+    failures = []
+    
+    def try_fetch(transcript_key: str):
+        try:
+            return fetch_transcript(transcript_key)
+        except Exception as e:
+            failures.append((transcript_key, repr(e)))
+            return None
+    
+    def write_dead_letters() -> None:
+        # Failed keys land under dlq/, where the next run's collect_dead_letters replays them;
+        # keys that have failed max_dead_letter_attempts times are retired to dlq/poison/
+        entries = {"dlq": [], "dlq/poison": []}
+        for key, error in failures:
+            attempts = dead_letter_attempts.get(key, 0) + 1
+            prefix = "dlq/poison" if attempts >= max_dead_letter_attempts else "dlq"
+            entries[prefix].append({"key": key, "error": error, "attempts": attempts})
+        
+        bucket = storage.Client().bucket(destination_bucket)
+        for prefix, prefix_failures in entries.items():
+            if not prefix_failures:
+                continue
+            bucket.blob(f"{prefix}/{run_id}/{task_id}.json").upload_from_string(
+                orjson.dumps({
+                    "run_id": run_id,
+                    "task_id": task_id,
+                    "failures": prefix_failures
+                }),
+                content_type='application/json'
+            )
+    
+    def load_rows(rows: List[dict]) -> int:
+        # The Snowflake connector is heavy to import, so only load it once there is work to write
+        import snowflake.connector
+        from cryptography.hazmat.primitives import serialization
+        
+        # Connection settings and the key-pair private key (PEM) live in one JSON secret
+        snowflake_config = orjson.loads(
+            secretmanager.SecretManagerServiceClient().access_secret_version(
+                name=snowflake_secret
+            ).payload.data
         )
+        private_key = serialization.load_pem_private_key(
+            snowflake_config.pop('private_key').encode('utf-8'),
+            password=None
+        ).private_bytes(
+            encoding=serialization.Encoding.DER,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+        
+        # One Snowflake session per pod for the whole bulk load
+        conn = snowflake.connector.connect(
+            **snowflake_config,
+            private_key=private_key,
+            client_session_keep_alive=True
+        )
+        try:
+            # Pin the session context once instead of per statement
+            cursor = conn.cursor()
+            for object_type in ('warehouse', 'database', 'schema'):
+                if snowflake_config.get(object_type):
+                    cursor.execute(f"USE {object_type.upper()} {snowflake_config[object_type]}")
+            cursor.close()
+            
+            # Save the whole batch to Snowflake with a single bulk load: write one parquet
+            # file straight from Arrow, PUT it to a temporary stage and COPY it in
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                parquet_path = os.path.join(tmp_dir, 'processed_transcripts.parquet')
+                
+                # Optional turn fields may only appear in later rows, so build the columns from
+                # the union of keys in first-seen order (from_pylist would only keep rows[0]'s)
+                columns = dict.fromkeys(key for row in rows for key in row)
+                table = pa.Table.from_pydict({
+                    column: [row.get(column) for row in rows]
+                    for column in columns
+                })
+                pq.write_table(table, parquet_path, compression='snappy')
+                
+                load_id = uuid.uuid4().hex.upper()
+                file_format = f"TRANSCRIPT_PARQUET_{load_id}"
+                stage = f"TRANSCRIPT_STAGE_{load_id}"
+                
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(f"CREATE TEMPORARY FILE FORMAT {file_format} TYPE=PARQUET USE_VECTORIZED_SCANNER=TRUE")
+                    cursor.execute(f"CREATE TEMPORARY STAGE {stage} FILE_FORMAT=(FORMAT_NAME={file_format})")
+                    cursor.execute(f"PUT 'file://{parquet_path}' @{stage} PARALLEL=8 AUTO_COMPRESS=FALSE")
+                    cursor.execute(
+                        f"""CREATE TABLE IF NOT EXISTS "processed_transcripts" USING TEMPLATE (
+                            SELECT ARRAY_AGG(OBJECT_CONSTRUCT(*))
+                            FROM TABLE(INFER_SCHEMA(LOCATION=>'@{stage}', FILE_FORMAT=>'{file_format}'))
+                        )"""
+                    )
+                    cursor.execute(
+                        f"""COPY INTO "processed_transcripts" FROM @{stage}
+                        FILE_FORMAT=(FORMAT_NAME={file_format})
+                        MATCH_BY_COLUMN_NAME=CASE_SENSITIVE
+                        PURGE=TRUE"""
+                    )
+                    return sum(result[3] for result in cursor.fetchall())
+                finally:
+                    cursor.close()
+        finally:
+            conn.close()
+    
+    # Small S3 objects are latency-bound, so download the whole batch concurrently
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        fetched = list(zip(transcript_keys, executor.map(try_fetch, transcript_keys)))
+    transcripts = [(key, data) for key, data in fetched if data is not None]
+    
+    # Short conversations go to the lighter model when one is configured
+    prompts_by_model = {}
+    for index, (transcript_key, transcript_data) in enumerate(transcripts):
+        try:
+            # Combine transcript text
+            full_text = ' '.join(t['Content'] for t in transcript_data['Transcript'])
+        except Exception as e:
+            failures.append((transcript_key, repr(e)))
+            continue
+        
+        if light_model_name and len(full_text) <= light_model_max_chars:
+            routed_model = light_model_name
+        else:
+            routed_model = model_name
+        
+        prompt = prompt_template.format(text=full_text)
+        prompts_by_model.setdefault(routed_model, []).append((index, prompt))
+    
+    # Process with Gemini: large batches go through batch inference, smaller ones run concurrently
+    replies = [None] * len(transcripts)
+    for routed_model, indexed_prompts in prompts_by_model.items():
+        indices = [index for index, _ in indexed_prompts]
+        prompts = [prompt for _, prompt in indexed_prompts]
+        try:
+            if len(prompts) >= batch_prediction_min_size:
+                model_replies = analyze_with_batch_job(prompts, routed_model)
+            else:
+                model_replies = asyncio.run(analyze_concurrently(prompts, routed_model))
+        except Exception as e:
+            model_replies = [e] * len(prompts)
+        for index, reply in zip(indices, model_replies):
+            replies[index] = reply
     
-    return f"Processed {transcript_key}: {nrows} rows written"
+    # Build one row per transcript turn with the analysis attached, without pandas
+    rows = []
+    loaded_keys = []
+    for (transcript_key, transcript_data), reply in zip(transcripts, replies):
+        if reply is None:
+            continue
+        try:
+            if isinstance(reply, Exception):
+                raise reply
+            analysis = parse_analysis(reply)
+            rows.extend({**turn, **analysis} for turn in transcript_data['Transcript'])
+            loaded_keys.append(transcript_key)
+        except Exception as e:
+            failures.append((transcript_key, repr(e)))
+    
+    nrows = 0
+    if rows:
+        try:
+            nrows = load_rows(rows)
+        except Exception as e:
+            failures.extend((transcript_key, repr(e)) for transcript_key in loaded_keys)
+    
+    write_dead_letters()
+    
+    return f"Processed {len(transcript_keys)} transcripts: {nrows} rows written, {len(failures)} failed"
 
 # Define the pipeline
 @dsl.pipeline(
@@ -119,46 +559,108 @@ def process_transcript(
     description="Process AWS Connect transcripts with parallel execution"
 )
 def transcript_pipeline(
-    aws_access_key_id: str,
-    aws_secret_key: str,
+    aws_role_arn: str,
     source_bucket: str,
     gcp_project: str,
     gcp_location: str,
     destination_bucket: str,
-    snowflake_credentials: dict,
-    max_parallel_executions: int = 10
+    snowflake_secret: str,
+    aws_token_audience: str = "sts.amazonaws.com",
+    key_prefix_format: str = "",
+    hex_shard_width: int = 0,
+    max_list_workers: int = 16,
+    max_dead_letter_attempts: int = 5,
+    batch_size: int = 50,
+    # Checked per worker chunk and routed model, so batch inference only runs when this
+    # is at most batch_size; raise both together for larger batch jobs
+    batch_prediction_min_size: int = 50,
+    llm_request_type: str = "",
+    model_name: str = "gemini-pro",
+    light_model_name: str = "",
+    light_model_max_chars: int = 4000
 ):
     # List new transcripts
     list_task = list_new_transcripts(
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_key=aws_secret_key,
-        source_bucket=source_bucket
+        aws_role_arn=aws_role_arn,
+        source_bucket=source_bucket,
+        key_prefix_format=key_prefix_format,
+        hex_shard_width=hex_shard_width,
+        max_list_workers=max_list_workers,
+        aws_token_audience=aws_token_audience
+    )
+    
+    # Replay keys that failed in earlier runs
+    dead_letter_task = collect_dead_letters(destination_bucket=destination_bucket)
+    
+    # Group transcripts so each worker pod amortises its startup over many files
+    chunk_task = chunk_list_for_parallelism(
+        files=list_task.output,
+        retry_files=dead_letter_task.outputs['transcript_keys'],
+        chunk_size=batch_size
     )
     
-    # Process transcripts in parallel with resource constraints
+    # Process batches in parallel with resource constraints
     with dsl.ParallelFor(
-        items=list_task.output,
-        parallelism=max_parallel_executions
-    ) as transcript_key:
-        process_transcript(
-            transcript_key=transcript_key,
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_key=aws_secret_key,
+        items=chunk_task.output,
+        parallelism=MAX_PARALLEL_EXECUTIONS
+    ) as transcript_keys:
+        # Explicit requests/limits so every worker lands on a node that fits the batch
+        process_task = process_transcript_batch(
+            transcript_keys=transcript_keys,
+            aws_role_arn=aws_role_arn,
             source_bucket=source_bucket,
             gcp_project=gcp_project,
             gcp_location=gcp_location,
             destination_bucket=destination_bucket,
-            snowflake_credentials=snowflake_credentials
-        )
+            snowflake_secret=snowflake_secret,
+            run_id=dsl.PIPELINE_JOB_ID_PLACEHOLDER,
+            task_id=dsl.PIPELINE_TASK_ID_PLACEHOLDER,
+            dead_letter_attempts=dead_letter_task.outputs['dead_letter_attempts'],
+            aws_token_audience=aws_token_audience,
+            max_dead_letter_attempts=max_dead_letter_attempts,
+            batch_prediction_min_size=batch_prediction_min_size,
+            llm_request_type=llm_request_type,
+            model_name=model_name,
+            light_model_name=light_model_name,
+            light_model_max_chars=light_model_max_chars
+        ).set_cpu_request('1').set_cpu_limit('2').set_memory_request('2Gi').set_memory_limit('4Gi')
+    
+    # Only drop the replayed entries once every batch has finished; if any batch task
+    # fails outright they stay in place for the next run
+    delete_dead_letters(
+        destination_bucket=dead_letter_task.outputs['destination_bucket'],
+        dead_letter_blobs=dead_letter_task.outputs['dead_letter_blobs']
+    ).after(process_task)
 
-# Compile and deploy the pipeline
-def deploy_pipeline():
-    pipeline_spec = "transcript_pipeline.json"
-    compiler.Compiler().compile(
-        pipeline_func=transcript_pipeline,
-        package_path=pipeline_spec
-    )
+# Build step: compile the pipeline and publish it to GCS only when its source changed
+def build_pipeline(template_uri: str = PIPELINE_TEMPLATE_URI) -> str:
+    from google.cloud import storage
+    
+    # Key on the whole module source so component edits also trigger a rebuild
+    with open(__file__, 'rb') as f:
+        source_hash = hashlib.sha256(f.read()).hexdigest()
+    
+    bucket_name, blob_name = template_uri[len("gs://"):].split("/", 1)
+    bucket = storage.Client().bucket(bucket_name)
+    published = bucket.get_blob(blob_name)
+    if published is not None and (published.metadata or {}).get('source_sha256') == source_hash:
+        return template_uri
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        package_path = os.path.join(tmp_dir, "transcript_pipeline.json")
+        compiler.Compiler().compile(
+            pipeline_func=transcript_pipeline,
+            package_path=package_path
+        )
+        
+        blob = bucket.blob(blob_name)
+        blob.metadata = {'source_sha256': source_hash}
+        blob.upload_from_filename(package_path, content_type='application/json')
     
+    return template_uri
+
+# Deploy the pipeline from the published spec
+def deploy_pipeline(template_uri: str = PIPELINE_TEMPLATE_URI):
     # Create pipeline job
     aiplatform.init(
         project="your-project",
@@ -167,35 +669,43 @@ def deploy_pipeline():
     
     job = aiplatform.PipelineJob(
         display_name="transcript-processing",
-        template_path=pipeline_spec,
+        template_path=template_uri,
         pipeline_root="gs://your-bucket/pipeline_root",
         parameter_values={
-            "aws_access_key_id": "your-key",
-            "aws_secret_key": "your-secret",
+            "aws_role_arn": "arn:aws:iam::your-account-id:role/your-transcript-reader",
             "source_bucket": "your-source-bucket",
             "gcp_project": "your-project",
             "gcp_location": "your-location",
             "destination_bucket": "your-destination-bucket",
-            "snowflake_credentials": {
-                "user": "your-user",
-                "password": "your-password",
-                "account": "your-account",
-                "warehouse": "your-warehouse",
-                "database": "your-database",
-                "schema": "your-schema"
-            },
-            "max_parallel_executions": 10
+            # JSON secret with user, account, warehouse, database, schema and private_key
+            "snowflake_secret": "projects/your-project/secrets/snowflake-transcripts/versions/latest",
+            # Only list the date prefixes inside the window (Connect writes per-day folders)
+            "key_prefix_format": "Analysis/Voice/%Y/%m/%d/",
+            # Object names start with the contact id (a UUID), so split each day 16 ways
+            "hex_shard_width": 1,
+            "max_list_workers": 16,
+            "max_dead_letter_attempts": 5,
+            "batch_size": 50,
+            "batch_prediction_min_size": 50,
+            "llm_request_type": "",
+            "model_name": "gemini-pro",
+            "light_model_name": "gemini-1.5-flash",
+            "light_model_max_chars": 4000
         }
     )
     
-    job.run()
+    # Components authenticate as this service account, to AWS and to Secret Manager
+    job.run(service_account="your-pipeline-sa@your-project.iam.gserviceaccount.com")
 
 # Schedule pipeline execution
-def create_schedule():
+def create_schedule(template_uri: str = PIPELINE_TEMPLATE_URI):
     aiplatform.PipelineJob.schedule(
         display_name="transcript-processing-schedule",
-        pipeline_file_path="transcript_pipeline.json",
+        pipeline_file_path=template_uri,
         schedule="0 */2 * * *",  # Every 2 hours
         time_zone="UTC",
         parameter_values={...}  # Same as above
     )
+
+if __name__ == "__main__":
+    print(build_pipeline())